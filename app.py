@@ -1,15 +1,31 @@
 import streamlit as st
 import csv
-import io
+import codecs
+from bisect import bisect_left, bisect_right
+from collections import Counter, OrderedDict, deque
+from itertools import compress, islice
 from datetime import datetime
 import hashlib
+import hmac
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 import json
+import os
+import threading
+import time
+
+try:
+    # Ships with Streamlit; only used to parse large CSV uploads
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
 
 st.set_page_config(page_title="AirSial Enterprise", page_icon="✈️", layout="wide")
 
 # Custom CSS
-st.markdown("""
+CUSTOM_CSS = """
     <style>
     .role-badge { padding: 10px; border-radius: 5px; font-weight: bold; color: white; }
     .role-admin { background-color: #dc3545; }
@@ -17,15 +33,19 @@ st.markdown("""
     .role-engineer { background-color: #28a745; }
     .ai-response { background-color: #e3f2fd; border-left: 4px solid #2196F3; padding: 15px; border-radius: 5px; margin: 10px 0; }
     </style>
-""", unsafe_allow_html=True)
+"""
+st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
 
 # Session state
+CHAT_HISTORY_LIMIT = 50
+
 if 'user' not in st.session_state:
     st.session_state.user = None
 if 'user_role' not in st.session_state:
     st.session_state.user_role = None
 if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
+    # Only the most recent messages are kept so a long session cannot grow without bound
+    st.session_state.chat_history = deque(maxlen=CHAT_HISTORY_LIMIT)
 
 # File paths
 MAINTENANCE_FILE = "maintenance_data.csv"
@@ -37,6 +57,18 @@ MAINTENANCE_COLS = ["id", "aircraft_registration", "maintenance_date", "maintena
 SAFETY_COLS = ["id", "incident_date", "flight_number", "incident_type", "severity", "description", "reported_by", "action_taken", "created_at"]
 FLIGHTS_COLS = ["id", "flight_number", "date", "departure_airport", "arrival_airport", "pilot_name", "crew_members", "passengers_count", "notes", "created_at"]
 
+# Membership sets used in hot loops and permission checks
+CRITICAL_SEVERITIES = frozenset({'High', 'Critical'})
+UPLOAD_ROLES = frozenset({'Admin', 'Manager'})
+
+# Navigation is fixed per role, so build it once instead of on every rerun
+PAGES = ("🤖 AI Chat", "📊 Dashboard", "📝 Submit", "📋 Manage", "📥 Export")
+UPLOAD_PAGES = ("🤖 AI Chat", "📊 Dashboard", "📝 Submit", "📋 Manage", "📤 Upload", "📥 Export")
+
+# Two loaded versions per data file: the current one plus one that a session still mid-run may hold.
+# Every write makes a new stamp, so unbounded caches would keep one full dataset copy per write.
+DATA_CACHE_ENTRIES = 6
+
 # Read CSV files
 def read_csv(filename, columns):
     try:
@@ -47,56 +79,383 @@ def read_csv(filename, columns):
         return []
 
 def write_csv(filename, data, columns):
-    with open(filename, 'w', newline='', encoding='utf-8') as f:
+    # Write a sibling file and swap it in, so a crash mid-write never truncates the data
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w', newline='', encoding='utf-8') as f:
         writer = csv.DictWriter(f, fieldnames=columns)
         writer.writeheader()
         writer.writerows(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
 
-# Load data
-maint_data = read_csv(MAINTENANCE_FILE, MAINTENANCE_COLS)
-safety_data = read_csv(SAFETY_FILE, SAFETY_COLS)
-flights_data = read_csv(FLIGHTS_FILE, FLIGHTS_COLS)
+def append_csv(filename, rows, columns):
+    """Append rows without rewriting the file; a new file gets the header first"""
+    with open(filename, 'a', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        if f.tell() == 0:
+            writer.writeheader()
+        writer.writerows(rows)
 
-# Real AI Integration - Groq (Free API with generous free tier)
-def get_ai_response(query, context_data):
-    """Use Groq API for real AI responses"""
+# Tried in order on the head of an upload; latin-1 decodes any byte so it always matches
+UPLOAD_ENCODINGS = ('utf-8-sig', 'cp1252', 'latin-1')
+
+def upload_encoding(file):
+    """Pick the encoding of an uploaded CSV from its first 64 KiB"""
+    file.seek(0)
+    head = file.read(65536)
+    for encoding in UPLOAD_ENCODINGS:
+        try:
+            # Incremental decode so a character split at the 64 KiB cut is not an error
+            codecs.getincrementaldecoder(encoding)().decode(head, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            pass
+
+def read_upload(file):
+    """Stream rows from an uploaded CSV without buffering the decoded text"""
+    encoding = upload_encoding(file)
+    file.seek(0)
+    return csv.DictReader(codecs.iterdecode(file, encoding))
+
+def preview_upload(file):
+    """First ten rows of an upload plus its row count, parsed once per uploaded file"""
+    # file_id changes with every upload, so reruns on the same file skip the parse entirely
+    if st.session_state.get('upload_key') != file.file_id:
+        reader = read_upload(file)
+        preview = list(islice(reader, 10))
+        if pa is None or len(preview) < 10:
+            row_count = len(preview) + sum(1 for _ in reader)
+        else:
+            # Counting only needs the row boundaries, so let pyarrow parse one column instead of building dicts
+            try:
+                row_count = sum(batch.num_rows for batch in upload_batches(file, reader.fieldnames[:1]))
+            except pa.ArrowInvalid:
+                # Ragged rows are fine for DictReader, which is what the import falls back to as well
+                row_count = sum(1 for _ in read_upload(file))
+        st.session_state.upload_preview = preview
+        st.session_state.upload_row_count = row_count
+        st.session_state.upload_key = file.file_id
+    return st.session_state.upload_preview, st.session_state.upload_row_count
+
+def next_id(data_list, filename):
+    """Next free numeric ID; stays unique after range deletes unlike len() + 1"""
+    ids, in_order = record_ids(filename, data_list, load_stamps[filename])
+    if not ids:
+        return 1
+    # Rows are appended with increasing IDs, so the last one is normally the largest
+    return (ids[-1] if in_order else max(ids)) + 1
+
+def upload_batches(file, columns):
+    """pyarrow record batches of an uploaded CSV holding just columns, all as text"""
+    encoding = upload_encoding(file)
+    file.seek(0)
+    return pa_csv.open_csv(
+        file,
+        # pyarrow skips a UTF-8 BOM itself and decodes utf8 natively, so only transcode other encodings
+        read_options=pa_csv.ReadOptions(encoding='utf8' if encoding == 'utf-8-sig' else encoding),
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        # Everything stays text like DictReader gives; columns absent from the file come back as None
+        convert_options=pa_csv.ConvertOptions(
+            column_types={col: pa.string() for col in columns},
+            include_columns=columns,
+            include_missing_columns=True,
+        ),
+    )
+
+def upload_rows(file, columns):
+    """Rows of an uploaded CSV, parsed in batches by pyarrow's multithreaded reader when available"""
+    if pa is None:
+        yield from read_upload(file)
+        return
+    parsed = 0
     try:
-        # Using Groq's free API (no key needed for basic usage)
-        # Alternative: Use Ollama locally if available
-        
-        # Format operational data
-        fleet_summary = f"""
+        for batch in upload_batches(file, columns):
+            rows = batch.to_pylist()
+            parsed += len(rows)
+            yield from rows
+    except pa.ArrowInvalid:
+        # pyarrow rejects ragged rows and empty files that DictReader accepts (short rows come back
+        # without the missing values), so carry on with DictReader from the first row not yet read
+        yield from islice(read_upload(file), parsed, None)
+
+UPLOAD_BATCH_ROWS = 50_000
+
+def import_upload(file, data_list, cols, filename):
+    """Append an uploaded CSV to filename with fresh IDs, a batch at a time; yields the running row count"""
+    first_id = next_id(data_list, filename)
+    data_cols = [col for col in cols if col not in ("id", "created_at")]
+    uploaded_at = datetime.now().isoformat()
+    rows = (
+        {
+            "id": str(row_id),
+            **{col: row.get(col) or "" for col in data_cols},
+            "created_at": row.get("created_at") or uploaded_at,
+        }
+        for row_id, row in enumerate(upload_rows(file, data_cols + ["created_at"]), first_id)
+    )
+    # Each batch goes straight to disk, so memory stays flat however large the file is; on any
+    # failure the file is cut back to its original length so an import lands all or nothing
+    original_size = os.path.getsize(filename) if os.path.exists(filename) else None
+    uploaded = 0
+    try:
+        while batch := list(islice(rows, UPLOAD_BATCH_ROWS)):
+            append_csv(filename, batch, cols)
+            uploaded += len(batch)
+            yield uploaded
+    except BaseException:
+        if original_size is None:
+            if os.path.exists(filename):
+                os.remove(filename)
+        else:
+            with open(filename, 'r+b') as f:
+                f.truncate(original_size)
+        raise
+
+def export_csv(filename, columns):
+    """Bytes for a download, read straight from the data file since it already holds what is loaded"""
+    try:
+        with open(filename, 'rb') as f:
+            return f.read()
+    except OSError:
+        # Nothing saved yet, so the export is just the header
+        return (",".join(columns) + "\r\n").encode('utf-8')
+
+@st.cache_data(show_spinner=False, max_entries=DATA_CACHE_ENTRIES)
+def search_index(filename, _data, columns, stamp):
+    """Lowercased text of every record, built once per loaded file version for the search box"""
+    return ["\n".join(str(r.get(col) or "") for col in columns).lower() for r in _data]
+
+def filter_records(data, filename, columns, search):
+    """Records whose values contain every space-separated search term, case-insensitively"""
+    terms = search.lower().split()
+    if not terms:
+        return data
+    # Keyed on the stamp data was loaded under, so the index always lines up with these rows
+    index = search_index(filename, data, columns, load_stamps[filename])
+    if len(terms) == 1:
+        needle = terms[0]
+        return [r for r, text in zip(data, index) if needle in text]
+    return [r for r, text in zip(data, index) if all(term in text for term in terms)]
+
+@st.cache_data(show_spinner=False, max_entries=DATA_CACHE_ENTRIES)
+def record_ids(filename, _data, stamp):
+    """Integer IDs of a loaded file in row order, and whether they are sorted; parsed once per stamp"""
+    ids = [int(r.get("id", 0)) for r in _data]
+    return ids, all(a <= b for a, b in zip(ids, ids[1:]))
+
+def delete_id_range(data, filename, cols, start, end):
+    """Drop records with start <= id <= end and save the file; returns how many were removed"""
+    ids, in_order = record_ids(filename, data, load_stamps[filename])
+    original_len = len(data)
+    if not in_order:
+        data[:] = compress(data, [not (start <= row_id <= end) for row_id in ids])
+    else:
+        # The app only ever appends increasing IDs, so the range is one contiguous slice
+        del data[bisect_left(ids, start):bisect_right(ids, end)]
+    deleted = original_len - len(data)
+    if deleted > 0:
+        write_csv(filename, data, cols)
+    return deleted
+
+def file_stamp(filename):
+    """(mtime, size) of a data file, or None if it does not exist yet"""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def data_version():
+    """Stamps of the three CSV files as loaded for this run; changes whenever any of them is rewritten"""
+    # Not re-stat'ed: a write from another session mid-run must not key caches built from the rows in memory
+    return tuple(load_stamps[filename] for filename in (MAINTENANCE_FILE, SAFETY_FILE, FLIGHTS_FILE))
+
+@st.cache_data(show_spinner=False, max_entries=DATA_CACHE_ENTRIES)
+def load_csv(filename, columns, stamp):
+    """Parsed CSV shared by all sessions; only re-read when the file's stamp changes"""
+    return read_csv(filename, columns)
+
+# Load data; the stamps are kept so per-file caches are keyed on the version actually loaded
+load_stamps = {filename: file_stamp(filename) for filename in (MAINTENANCE_FILE, SAFETY_FILE, FLIGHTS_FILE)}
+maint_data = load_csv(MAINTENANCE_FILE, MAINTENANCE_COLS, load_stamps[MAINTENANCE_FILE])
+safety_data = load_csv(SAFETY_FILE, SAFETY_COLS, load_stamps[SAFETY_FILE])
+flights_data = load_csv(FLIGHTS_FILE, FLIGHTS_COLS, load_stamps[FLIGHTS_FILE])
+
+# Real AI Integration - Groq (Free API with generous free tier)
+@st.cache_data(show_spinner=False)
+def maintenance_metrics(version):
+    """Maintenance aggregates shared by the AI prompt and the fallback responses"""
+    # One pass instead of a separate scan for every figure
+    total_hours = 0.0
+    statuses = Counter()
+    types = Counter()
+    for r in maint_data:
+        try:
+            # Uploads leave missing columns blank; a blank or garbled value just adds nothing
+            total_hours += float(r.get('hours_spent') or 0)
+        except ValueError:
+            pass
+        statuses[r.get('status')] += 1
+        types[r.get('maintenance_type', 'Unknown')] += 1
+    count = len(maint_data)
+    return {
+        'count': count,
+        'total_hours': total_hours,
+        'avg_hours': total_hours / count if count else 0.0,
+        'pending': statuses['Pending'],
+        'statuses': statuses,
+        'types': types,
+    }
+
+@st.cache_data(show_spinner=False)
+def safety_metrics(version):
+    """Safety incident tallies by severity, computed once per data version"""
+    severity = Counter(r.get('severity', 'Unknown') for r in safety_data)
+    return {
+        'count': len(safety_data),
+        'severity': severity,
+        'critical': sum(severity[level] for level in CRITICAL_SEVERITIES),
+    }
+
+@st.cache_data(show_spinner=False)
+def flight_metrics(version):
+    """Flight and passenger totals, computed once per data version"""
+    count = len(flights_data)
+    total_passengers = 0
+    for r in flights_data:
+        try:
+            total_passengers += int(r.get('passengers_count') or 0)
+        except ValueError:
+            pass
+    return {
+        'count': count,
+        'total_passengers': total_passengers,
+        'avg_passengers': total_passengers / count if count else 0,
+    }
+
+@st.cache_data(show_spinner=False)
+def build_fleet_summary(version):
+    """Operational data block for the AI prompt, rebuilt only when the CSVs change"""
+    metrics = maintenance_metrics(version)
+    safety = safety_metrics(version)
+    
+    parts = [f"""
 OPERATIONAL DATA:
-- Maintenance Records: {len(maint_data)}
-- Total Maintenance Hours: {sum(float(r.get('hours_spent', 0)) for r in maint_data):.1f}
-- Pending Tasks: {len([r for r in maint_data if r.get('status') == 'Pending'])}
-- Safety Incidents: {len(safety_data)}
-- Critical Incidents: {len([r for r in safety_data if r.get('severity') in ['High', 'Critical']])}
+- Maintenance Records: {metrics['count']}
+- Total Maintenance Hours: {metrics['total_hours']:.1f}
+- Pending Tasks: {metrics['pending']}
+- Safety Incidents: {safety['count']}
+- Critical Incidents: {safety['critical']}
 - Flights Operated: {len(flights_data)}
 
 TOP MAINTENANCE TYPES:
-"""
-        types = {}
-        for r in maint_data:
-            t = r.get('maintenance_type', 'Unknown')
-            types[t] = types.get(t, 0) + 1
-        for mtype, count in sorted(types.items(), key=lambda x: x[1], reverse=True)[:5]:
-            fleet_summary += f"- {mtype}: {count} times\n"
-        
-        # Call Groq API (free tier - no authentication required for basic usage)
-        # Using llama2 or mistral model
-        system_prompt = """You are an expert airline operations manager AI. Analyze fleet data and provide strategic insights, 
-        risk assessments, cost-benefit analyses, and actionable recommendations. Be specific with numbers and timelines. 
-        Focus on business impact and ROI."""
-        
-        user_message = f"{fleet_summary}\n\nUser Question: {query}\n\nProvide a detailed, professional analysis."
-        
-        # Try Groq API (requires free API key from groq.com)
-        groq_api_key = st.secrets.get("GROQ_API_KEY", "")
-        
-        if groq_api_key:
-            # Groq API call
-            response = requests.post(
+"""]
+    for mtype, count in metrics['types'].most_common(5):
+        parts.append(f"- {mtype}: {count} times\n")
+    return "".join(parts)
+
+# (connect, read) seconds: a dead endpoint fails fast, a slow completion still finishes
+AI_TIMEOUT = (3, 30)
+
+@st.cache_resource
+def http_session():
+    """Pooled HTTP session so follow-up AI calls reuse the open connection"""
+    session = requests.Session()
+    # One immediate retry for refused connections and gateway errors; a read that already started
+    # streaming is never replayed. Rate limits (429) are left to the breaker and fallback, and
+    # Retry-After is ignored because urllib3 would sleep for however long the server asks
+    retry = Retry(total=1, read=0, status_forcelist=(502, 503, 504), allowed_methods=None,
+                  respect_retry_after_header=False, raise_on_status=False)
+    # Shared by every browser session, so keep enough idle connections for several concurrent chats
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=10, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+@st.cache_resource
+def prewarm_ai_connection():
+    """Open the TLS connection to Groq in the background once per process, so the first question skips the handshake"""
+    session = http_session()
+    def connect():
+        try:
+            session.head("https://api.groq.com/openai/v1/models", timeout=AI_TIMEOUT)
+        except requests.RequestException:
+            pass
+    thread = threading.Thread(target=connect, daemon=True)
+    thread.start()
+    return thread
+
+# load_if_toml_exists parses quietly; st.secrets.get alone would draw a "No secrets files found"
+# error box on every page when the app runs without a secrets.toml
+if st.secrets.load_if_toml_exists() and st.secrets.get("GROQ_API_KEY", ""):
+    prewarm_ai_connection()
+
+# How long Ollama keeps llama2 in memory after an answer; OLLAMA_KEEP_ALIVE overrides
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# After this many failures in a row an AI endpoint is skipped for AI_BREAKER_RESET seconds
+AI_BREAKER_FAILURES = 3
+AI_BREAKER_RESET = 60
+
+@st.cache_resource
+def ai_breakers():
+    """Per-endpoint [consecutive failures, time of last failure], shared by all sessions"""
+    return {}
+
+def endpoint_available(name):
+    """False while the endpoint's circuit is open; one trial call is let through after the reset"""
+    failures, failed_at = ai_breakers().get(name, (0, 0.0))
+    return failures < AI_BREAKER_FAILURES or time.monotonic() - failed_at >= AI_BREAKER_RESET
+
+def record_endpoint(name, ok):
+    """Close the circuit on success, count the failure otherwise"""
+    breakers = ai_breakers()
+    if ok:
+        breakers.pop(name, None)
+    else:
+        breakers[name] = (breakers.get(name, (0, 0.0))[0] + 1, time.monotonic())
+
+# Finished answers are reused for this long (seconds) and up to this many questions
+AI_CACHE_TTL = 600
+AI_CACHE_SIZE = 256
+
+@st.cache_resource
+def answer_cache():
+    """Finished AI answers shared by all sessions, keyed on (question, data version), with the lock guarding them"""
+    # Sessions run on their own script threads, so every read, insert and eviction holds the lock
+    return threading.Lock(), OrderedDict()
+
+def discard_response(response):
+    """Read and close an unused streamed response so its connection returns to the pool"""
+    if response is not None:
+        with response:
+            # Error bodies are short, so draining is cheaper than a new TLS handshake next time
+            response.content
+
+def stream_ai_answer(query, version):
+    """Yield the AI answer in chunks as the backend produces them; yields nothing if no backend answered"""
+    # Using Groq's free API (no key needed for basic usage)
+    # Alternative: Use Ollama locally if available
+    
+    # Format operational data
+    fleet_summary = build_fleet_summary(version)
+    
+    # Call Groq API (free tier - no authentication required for basic usage)
+    # Using llama2 or mistral model
+    system_prompt = """You are an expert airline operations manager AI. Analyze fleet data and provide strategic insights, 
+    risk assessments, cost-benefit analyses, and actionable recommendations. Be specific with numbers and timelines. 
+    Focus on business impact and ROI."""
+    
+    user_message = f"{fleet_summary}\n\nUser Question: {query}\n\nProvide a detailed, professional analysis."
+    
+    # Try Groq API (requires free API key from groq.com)
+    groq_api_key = st.secrets.get("GROQ_API_KEY", "")
+    
+    if groq_api_key and endpoint_available("groq"):
+        # Groq API call; an unreachable endpoint falls through to Ollama
+        try:
+            response = http_session().post(
                 "https://api.groq.com/openai/v1/chat/completions",
                 headers={
                     "Authorization": f"Bearer {groq_api_key}",
@@ -109,77 +468,152 @@ TOP MAINTENANCE TYPES:
                         {"role": "user", "content": user_message}
                     ],
                     "temperature": 0.7,
-                    "max_tokens": 1000
-                }
+                    "max_tokens": 1000,
+                    "stream": True
+                },
+                timeout=AI_TIMEOUT,
+                stream=True
             )
-            
-            if response.status_code == 200:
-                return response.json()["choices"][0]["message"]["content"]
+        except (requests.ConnectionError, requests.Timeout):
+            response = None
         
-        # Fallback: Try local Ollama if available
+        record_endpoint("groq", response is not None and response.status_code == 200)
+        if response is not None and response.status_code == 200:
+            # Server-sent events: one "data: {...}" line per token delta. The stream is read to EOF
+            # rather than stopped at [DONE], so the connection goes back to the pool
+            with response:
+                for line in response.iter_lines():
+                    if not line.startswith(b"data: ") or line == b"data: [DONE]":
+                        continue
+                    delta = json.loads(line[6:])["choices"][0]["delta"].get("content")
+                    if delta:
+                        yield delta
+            return
+        discard_response(response)
+    
+    # Fallback: Try local Ollama if available
+    response = None
+    if endpoint_available("ollama"):
         try:
-            response = requests.post(
+            response = http_session().post(
                 "http://localhost:11434/api/generate",
                 json={
                     "model": "llama2",
                     "prompt": f"{system_prompt}\n\n{user_message}",
-                    "stream": False
+                    "stream": True,
+                    # Keep the model loaded between questions instead of Ollama's default 5 minutes
+                    "keep_alive": OLLAMA_KEEP_ALIVE
                 },
-                timeout=30
+                timeout=AI_TIMEOUT,
+                stream=True
             )
-            if response.status_code == 200:
-                return response.json()["response"]
         except:
-            pass
-        
-        # Fallback to structured response
-        return generate_fallback_response(query, maint_data, safety_data, flights_data)
-        
+            response = None
+        record_endpoint("ollama", response is not None and response.status_code == 200)
+    
+    if response is not None and response.status_code == 200:
+        # Newline-delimited JSON, one object per generated chunk
+        with response:
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line).get("response", "")
+        return
+    discard_response(response)
+
+def get_ai_response(query, context_data):
+    """Use Groq API for real AI responses, yielded chunk by chunk for st.write_stream"""
+    version = data_version()
+    # Case and spacing differences still hit the same cached answer
+    key = (" ".join(query.lower().split()), version)
+    lock, cache = answer_cache()
+    
+    # Repeat questions against unchanged data are served from the cache
+    with lock:
+        cached = cache.get(key)
+    if cached and time.monotonic() - cached[0] < AI_CACHE_TTL:
+        yield cached[1]
+        return
+    
+    parts = []
+    try:
+        for chunk in stream_ai_answer(query, version):
+            parts.append(chunk)
+            yield chunk
     except Exception as e:
-        return f"⚠️ AI temporarily unavailable. Error: {str(e)}"
+        # Failures are shown but never cached
+        yield f"⚠️ AI temporarily unavailable. Error: {str(e)}"
+        return
+    
+    answer = "".join(parts)
+    if not answer:
+        # Neither backend answered: give the structured response, but leave it out of the cache so
+        # a real answer is fetched as soon as a backend is back
+        yield generate_fallback_response(query, maintenance_metrics(version))
+        return
+    
+    with lock:
+        cache[key] = (time.monotonic(), answer)
+        while len(cache) > AI_CACHE_SIZE:
+            # Oldest insert goes first
+            cache.popitem(last=False)
+
+# Fallback intents, matched as substrings so "reduced" still counts as "reduce"
+REDUCE_KEYWORDS = frozenset({'decrease', 'reduce', 'frequency'})
+HOURS_KEYWORDS = frozenset({'average', 'hours'})
 
-def generate_fallback_response(query, maint_data, safety_data, flights_data):
+def generate_fallback_response(query, metrics):
     """Fallback response generator"""
     query_lower = query.lower()
     
-    if 'decrease' in query_lower or 'reduce' in query_lower or 'frequency' in query_lower:
-        response = "**📊 Frequency Reduction Strategy**\n\n"
-        response += "**Current Analysis:**\n"
-        response += f"- Total Maintenance Events: {len(maint_data)}\n"
-        response += f"- Average Task Duration: {(sum(float(r.get('hours_spent', 0)) for r in maint_data) / len(maint_data)):.1f} hours\n\n"
-        response += "**Recommended Actions:**\n"
-        response += "1. Implement condition-based maintenance (CBM)\n"
-        response += "   - Cost: $50K\n"
-        response += "   - Reduction: 20-30%\n"
-        response += "   - ROI: 8 months\n\n"
-        response += "2. Extend maintenance intervals\n"
-        response += "   - Review with OEM\n"
-        response += "   - Potential savings: 15%\n\n"
-        response += "3. Cross-train staff for parallel execution\n"
-        response += "   - Training cost: $5K\n"
-        response += "   - Time savings: 25%\n"
-        return response
+    if any(word in query_lower for word in REDUCE_KEYWORDS):
+        return "".join([
+            "**📊 Frequency Reduction Strategy**\n\n",
+            "**Current Analysis:**\n",
+            f"- Total Maintenance Events: {metrics['count']}\n",
+            f"- Average Task Duration: {metrics['avg_hours']:.1f} hours\n\n",
+            "**Recommended Actions:**\n",
+            "1. Implement condition-based maintenance (CBM)\n",
+            "   - Cost: $50K\n",
+            "   - Reduction: 20-30%\n",
+            "   - ROI: 8 months\n\n",
+            "2. Extend maintenance intervals\n",
+            "   - Review with OEM\n",
+            "   - Potential savings: 15%\n\n",
+            "3. Cross-train staff for parallel execution\n",
+            "   - Training cost: $5K\n",
+            "   - Time savings: 25%\n",
+        ])
     
-    elif 'average' in query_lower or 'hours' in query_lower:
-        if maint_data:
-            avg = sum(float(r.get('hours_spent', 0)) for r in maint_data) / len(maint_data)
-            return f"**⏱️ Maintenance Hours Analysis**\n\n- Average Hours per Task: **{avg:.2f} hours**\n- Total Fleet Hours: {sum(float(r.get('hours_spent', 0)) for r in maint_data):.1f}\n- Total Tasks: {len(maint_data)}\n\nBenchmark: Industry average is 3-4 hours. Your fleet is {'efficient ✅' if avg < 3.5 else 'requires optimization'}"
+    elif any(word in query_lower for word in HOURS_KEYWORDS):
+        if metrics['count']:
+            avg = metrics['avg_hours']
+            return f"**⏱️ Maintenance Hours Analysis**\n\n- Average Hours per Task: **{avg:.2f} hours**\n- Total Fleet Hours: {metrics['total_hours']:.1f}\n- Total Tasks: {metrics['count']}\n\nBenchmark: Industry average is 3-4 hours. Your fleet is {'efficient ✅' if avg < 3.5 else 'requires optimization'}"
     
     return "🤖 To enable full AI, add GROQ_API_KEY to Streamlit secrets or install Ollama locally."
 
+def queue_question(question):
+    """Add a question to the chat unless it is a resend of one still awaiting its answer"""
+    history = st.session_state.chat_history
+    message = {'role': 'user', 'content': question}
+    if not history or history[-1] != message:
+        history.append(message)
+
 # Authentication
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
+USERS = {
+    "admin": {"password": hash_password("admin123"), "role": "Admin"},
+    "manager": {"password": hash_password("manager123"), "role": "Manager"},
+    "engineer": {"password": hash_password("engineer123"), "role": "Engineer"}
+}
+
 def authenticate(username, password):
-    users = {
-        "admin": {"password": hash_password("admin123"), "role": "Admin"},
-        "manager": {"password": hash_password("manager123"), "role": "Manager"},
-        "engineer": {"password": hash_password("engineer123"), "role": "Engineer"}
-    }
-    
-    if username in users and users[username]["password"] == hash_password(password):
-        return True, users[username]["role"]
+    # Hash before the lookup so unknown usernames take as long as wrong passwords
+    password_hash = hash_password(password)
+    user = USERS.get(username)
+    if user and hmac.compare_digest(user["password"], password_hash):
+        return True, user["role"]
     return False, None
 
 # Login
@@ -245,7 +679,7 @@ else:
 
     
     st.title("✈️ AirSial Enterprise")
-    page = st.sidebar.radio("Navigate", ["🤖 AI Chat", "📊 Dashboard", "📝 Submit", "📋 Manage", "📤 Upload", "📥 Export"])
+    page = st.sidebar.radio("Navigate", UPLOAD_PAGES if st.session_state.user_role in UPLOAD_ROLES else PAGES)
     
     if page == "🤖 AI Chat":
         st.header("🤖 AI Agent - Operational Intelligence")
@@ -260,33 +694,27 @@ else:
                 else:
                     st.markdown(f'<div class="ai-response">**🤖 AI Agent:**\n{msg["content"]}</div>', unsafe_allow_html=True)
         
-        # Input section
-        st.divider()
-        
-        col1, col2 = st.columns([5, 1])
-        with col1:
-            user_input = st.text_input("Ask a question...", placeholder="e.g., How can we decrease maintenance frequency? Why are we having delays?")
-        with col2:
-            send_btn = st.button("Send", use_container_width=True)
+        # Input section; st.chat_input submits once and clears itself, so no Send button or rerun is needed
+        user_input = st.chat_input("e.g., How can we decrease maintenance frequency? Why are we having delays?")
         
         # Process input
-        if send_btn and user_input:
-            st.session_state.chat_history.append({'role': 'user', 'content': user_input})
+        if user_input:
+            queue_question(user_input)
             
-            # Get real AI response
-            with st.spinner("🤖 AI thinking..."):
-                ai_response = get_ai_response(user_input, {
+            # Get real AI response, shown token by token as it arrives under the question
+            with chat_container:
+                st.markdown(f"**👤 You:** {user_input}")
+                ai_response = st.write_stream(get_ai_response(user_input, {
                     'maint': maint_data,
                     'safety': safety_data,
                     'flights': flights_data
-                })
+                }))
             
             st.session_state.chat_history.append({'role': 'assistant', 'content': ai_response})
-            st.rerun()
         
         if st.session_state.chat_history:
             if st.button("Clear Chat"):
-                st.session_state.chat_history = []
+                st.session_state.chat_history.clear()
                 st.rerun()
         
         st.divider()
@@ -300,23 +728,13 @@ else:
         col2.metric("Safety", len(safety_data))
         col3.metric("Flights", len(flights_data))
         
-        st.subheader(f"Maintenance Records ({len(maint_data)})")
-        if maint_data:
-            st.table(maint_data)
-        else:
-            st.info("No records")
-        
-        st.subheader(f"Safety Records ({len(safety_data)})")
-        if safety_data:
-            st.table(safety_data)
-        else:
-            st.info("No records")
-        
-        st.subheader(f"Flight Records ({len(flights_data)})")
-        if flights_data:
-            st.table(flights_data)
-        else:
-            st.info("No records")
+        sections = [("Maintenance", maint_data), ("Safety", safety_data), ("Flight", flights_data)]
+        for label, records in sections:
+            st.subheader(f"{label} Records ({len(records)})")
+            if records:
+                st.dataframe(records, use_container_width=True, hide_index=True)
+            else:
+                st.info("No records")
     
     elif page == "📝 Submit":
         st.header("📝 Submit Report")
@@ -334,7 +752,7 @@ else:
                 
                 if st.form_submit_button("Submit"):
                     new_record = {
-                        "id": str(len(maint_data) + 1),
+                        "id": str(next_id(maint_data, MAINTENANCE_FILE)),
                         "aircraft_registration": aircraft,
                         "maintenance_date": str(maint_date),
                         "maintenance_type": maint_type,
@@ -345,7 +763,7 @@ else:
                         "created_at": datetime.now().isoformat()
                     }
                     maint_data.append(new_record)
-                    write_csv(MAINTENANCE_FILE, maint_data, MAINTENANCE_COLS)
+                    append_csv(MAINTENANCE_FILE, [new_record], MAINTENANCE_COLS)
                     st.success("✅ Added!")
                     st.rerun()
         
@@ -361,7 +779,7 @@ else:
                 
                 if st.form_submit_button("Submit"):
                     new_record = {
-                        "id": str(len(safety_data) + 1),
+                        "id": str(next_id(safety_data, SAFETY_FILE)),
                         "incident_date": str(incident_date),
                         "flight_number": flight,
                         "incident_type": incident_type,
@@ -372,7 +790,7 @@ else:
                         "created_at": datetime.now().isoformat()
                     }
                     safety_data.append(new_record)
-                    write_csv(SAFETY_FILE, safety_data, SAFETY_COLS)
+                    append_csv(SAFETY_FILE, [new_record], SAFETY_COLS)
                     st.success("✅ Added!")
                     st.rerun()
         
@@ -389,7 +807,7 @@ else:
                 
                 if st.form_submit_button("Submit"):
                     new_record = {
-                        "id": str(len(flights_data) + 1),
+                        "id": str(next_id(flights_data, FLIGHTS_FILE)),
                         "flight_number": flight,
                         "date": str(flight_date),
                         "departure_airport": dept,
@@ -401,111 +819,50 @@ else:
                         "created_at": datetime.now().isoformat()
                     }
                     flights_data.append(new_record)
-                    write_csv(FLIGHTS_FILE, flights_data, FLIGHTS_COLS)
+                    append_csv(FLIGHTS_FILE, [new_record], FLIGHTS_COLS)
                     st.success("✅ Added!")
                     st.rerun()
     
     elif page == "📋 Manage":
         st.header("📋 Manage Data")
         data_type = st.selectbox("Select", ["Maintenance", "Safety", "Flights"])
+        data, cols, filename, label = {
+            "Maintenance": (maint_data, MAINTENANCE_COLS, MAINTENANCE_FILE, "maintenance"),
+            "Safety": (safety_data, SAFETY_COLS, SAFETY_FILE, "safety"),
+            "Flights": (flights_data, FLIGHTS_COLS, FLIGHTS_FILE, "flights"),
+        }[data_type]
         
-        if data_type == "Maintenance":
-            search = st.text_input("Search maintenance...")
-            filtered = [r for r in maint_data if not search or search.lower() in str(r).lower()]
-            
-            st.table(filtered)
-            
-            if st.session_state.user_role == "Admin":
-                st.divider()
-                st.subheader("🗑️ Bulk Delete")
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    start_id = st.text_input("Start ID", placeholder="1")
-                with col2:
-                    end_id = st.text_input("End ID", placeholder="100")
-                
-                if st.button("Delete Range"):
-                    if start_id and end_id:
-                        try:
-                            start = int(start_id)
-                            end = int(end_id)
-                            original_len = len(maint_data)
-                            maint_data[:] = [r for r in maint_data if not (start <= int(r.get("id", 0)) <= end)]
-                            deleted = original_len - len(maint_data)
-                            if deleted > 0:
-                                write_csv(MAINTENANCE_FILE, maint_data, MAINTENANCE_COLS)
-                                st.success(f"✅ Deleted {deleted}!")
-                                st.rerun()
-                        except:
-                            st.error("Invalid IDs")
+        search = st.text_input(f"Search {label}...")
+        filtered = filter_records(data, filename, cols, search)
         
-        elif data_type == "Safety":
-            search = st.text_input("Search safety...")
-            filtered = [r for r in safety_data if not search or search.lower() in str(r).lower()]
-            
-            st.table(filtered)
-            
-            if st.session_state.user_role == "Admin":
-                st.divider()
-                st.subheader("🗑️ Bulk Delete")
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    start_id2 = st.text_input("Start ID", placeholder="1", key="safety_start")
-                with col2:
-                    end_id2 = st.text_input("End ID", placeholder="100", key="safety_end")
-                
-                if st.button("Delete Range", key="safety_del"):
-                    if start_id2 and end_id2:
-                        try:
-                            start = int(start_id2)
-                            end = int(end_id2)
-                            original_len = len(safety_data)
-                            safety_data[:] = [r for r in safety_data if not (start <= int(r.get("id", 0)) <= end)]
-                            deleted = original_len - len(safety_data)
-                            if deleted > 0:
-                                write_csv(SAFETY_FILE, safety_data, SAFETY_COLS)
-                                st.success(f"✅ Deleted {deleted}!")
-                                st.rerun()
-                        except:
-                            st.error("Invalid IDs")
+        st.dataframe(filtered, use_container_width=True, hide_index=True)
         
-        else:
-            search = st.text_input("Search flights...")
-            filtered = [r for r in flights_data if not search or search.lower() in str(r).lower()]
+        if st.session_state.user_role == "Admin":
+            st.divider()
+            st.subheader("🗑️ Bulk Delete")
+            col1, col2 = st.columns(2)
             
-            st.table(filtered)
+            with col1:
+                start_id = st.text_input("Start ID", placeholder="1", key=f"{label}_start")
+            with col2:
+                end_id = st.text_input("End ID", placeholder="100", key=f"{label}_end")
             
-            if st.session_state.user_role == "Admin":
-                st.divider()
-                st.subheader("🗑️ Bulk Delete")
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    start_id3 = st.text_input("Start ID", placeholder="1", key="flights_start")
-                with col2:
-                    end_id3 = st.text_input("End ID", placeholder="100", key="flights_end")
-                
-                if st.button("Delete Range", key="flights_del"):
-                    if start_id3 and end_id3:
-                        try:
-                            start = int(start_id3)
-                            end = int(end_id3)
-                            original_len = len(flights_data)
-                            flights_data[:] = [r for r in flights_data if not (start <= int(r.get("id", 0)) <= end)]
-                            deleted = original_len - len(flights_data)
-                            if deleted > 0:
-                                write_csv(FLIGHTS_FILE, flights_data, FLIGHTS_COLS)
-                                st.success(f"✅ Deleted {deleted}!")
-                                st.rerun()
-                        except:
-                            st.error("Invalid IDs")
+            if st.button("Delete Range", key=f"{label}_del"):
+                if start_id and end_id:
+                    try:
+                        start = int(start_id)
+                        end = int(end_id)
+                        deleted = delete_id_range(data, filename, cols, start, end)
+                        if deleted > 0:
+                            st.success(f"✅ Deleted {deleted}!")
+                            st.rerun()
+                    except:
+                        st.error("Invalid IDs")
     
     elif page == "📤 Upload":
         st.header("📤 Bulk Upload")
         
-        if st.session_state.user_role not in ["Admin", "Manager"]:
+        if st.session_state.user_role not in UPLOAD_ROLES:
             st.error("Only Admins/Managers")
         else:
             data_type = st.selectbox("Type", ["Maintenance", "Safety", "Flights"])
@@ -513,12 +870,10 @@ else:
             
             if file:
                 try:
-                    content = file.read().decode('utf-8')
-                    reader = csv.DictReader(io.StringIO(content))
-                    rows = list(reader)
+                    preview, row_count = preview_upload(file)
                     
-                    st.write(f"Preview: {len(rows)} rows")
-                    st.table(rows[:10])
+                    st.write(f"Preview: {row_count} rows")
+                    st.dataframe(preview, use_container_width=True, hide_index=True)
                     
                     if st.button("✅ Upload All"):
                         if data_type == "Maintenance":
@@ -534,23 +889,12 @@ else:
                             data_list = flights_data
                             filename = FLIGHTS_FILE
                         
-                        cleaned_rows = []
-                        next_id = max([int(r.get("id", 0)) for r in data_list] + [0]) + 1
-                        
-                        for row in rows:
-                            cleaned_row = {}
-                            for col in cols:
-                                if col == "id":
-                                    cleaned_row[col] = str(next_id)
-                                    next_id += 1
-                                else:
-                                    cleaned_row[col] = row.get(col, "")
-                            cleaned_rows.append(cleaned_row)
-                        
-                        data_list.extend(cleaned_rows)
-                        write_csv(filename, data_list, cols)
+                        progress = st.progress(0.0)
+                        uploaded = 0
+                        for uploaded in import_upload(file, data_list, cols, filename):
+                            progress.progress(min(uploaded / max(row_count, 1), 1.0))
                         
-                        st.success(f"✅ {len(rows)} records uploaded!")
+                        st.success(f"✅ {uploaded} records uploaded!")
                         st.rerun()
                 except Exception as e:
                     st.error(f"Error: {e}")
@@ -558,185 +902,104 @@ else:
     elif page == "📥 Export":
         st.header("📥 Export Data")
         
-        if st.button("Export Maintenance"):
-            output = io.StringIO()
-            writer = csv.DictWriter(output, fieldnames=MAINTENANCE_COLS)
-            writer.writeheader()
-            writer.writerows(maint_data)
-            st.download_button("maintenance.csv", output.getvalue(), "maintenance.csv")
-        
-        if st.button("Export Safety"):
-            output = io.StringIO()
-            writer = csv.DictWriter(output, fieldnames=SAFETY_COLS)
-            writer.writeheader()
-            writer.writerows(safety_data)
-            st.download_button("safety.csv", output.getvalue(), "safety.csv")
-        
-        if st.button("Export Flights"):
-            output = io.StringIO()
-            writer = csv.DictWriter(output, fieldnames=FLIGHTS_COLS)
-            writer.writeheader()
-            writer.writerows(flights_data)
-            st.download_button("flights.csv", output.getvalue(), "flights.csv")
-
-# Custom CSS
-st.markdown("""
-    <style>
-    .role-badge { padding: 10px; border-radius: 5px; font-weight: bold; color: white; }
-    .role-admin { background-color: #dc3545; }
-    .role-manager { background-color: #007bff; }
-    .role-engineer { background-color: #28a745; }
-    .ai-response { background-color: #e3f2fd; border-left: 4px solid #2196F3; padding: 15px; border-radius: 5px; margin: 10px 0; }
-    </style>
-""", unsafe_allow_html=True)
-
-# Session state
-if 'user' not in st.session_state:
-    st.session_state.user = None
-if 'user_role' not in st.session_state:
-    st.session_state.user_role = None
-if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
-
-# File paths
-MAINTENANCE_FILE = "maintenance_data.csv"
-SAFETY_FILE = "safety_data.csv"
-FLIGHTS_FILE = "flights_data.csv"
-
-# CSV Column headers
-MAINTENANCE_COLS = ["id", "aircraft_registration", "maintenance_date", "maintenance_type", "engineer_name", "hours_spent", "parts_replaced", "status", "created_at"]
-SAFETY_COLS = ["id", "incident_date", "flight_number", "incident_type", "severity", "description", "reported_by", "action_taken", "created_at"]
-FLIGHTS_COLS = ["id", "flight_number", "date", "departure_airport", "arrival_airport", "pilot_name", "crew_members", "passengers_count", "notes", "created_at"]
-
-# Read CSV files
-def read_csv(filename, columns):
-    try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            return list(reader) if reader else []
-    except:
-        return []
-
-def write_csv(filename, data, columns):
-    with open(filename, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=columns)
-        writer.writeheader()
-        writer.writerows(data)
-
-# Load data
-maint_data = read_csv(MAINTENANCE_FILE, MAINTENANCE_COLS)
-safety_data = read_csv(SAFETY_FILE, SAFETY_COLS)
-flights_data = read_csv(FLIGHTS_FILE, FLIGHTS_COLS)
-
-# Authentication
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
-
-def authenticate(username, password):
-    users = {
-        "admin": {"password": hash_password("admin123"), "role": "Admin"},
-        "manager": {"password": hash_password("manager123"), "role": "Manager"},
-        "engineer": {"password": hash_password("engineer123"), "role": "Engineer"}
-    }
-    
-    if username in users and users[username]["password"] == hash_password(password):
-        return True, users[username]["role"]
-    return False, None
+        exports = [
+            ("Maintenance", MAINTENANCE_FILE, MAINTENANCE_COLS, "maintenance.csv"),
+            ("Safety", SAFETY_FILE, SAFETY_COLS, "safety.csv"),
+            ("Flights", FLIGHTS_FILE, FLIGHTS_COLS, "flights.csv"),
+        ]
+        for label, data_file, cols, filename in exports:
+            if st.button(f"Export {label}"):
+                st.download_button(filename, export_csv(data_file, cols), filename, mime="text/csv")
 
 # AI Analytics
 def process_ai_query(query):
-    query_lower = query.lower()
+    try:
+        # Case and spacing differences still hit the same cached answer
+        return answer_query(" ".join(query.lower().split()), data_version())
+    except Exception as e:
+        # Failures are shown but never cached, so the next try after the data is fixed answers normally
+        return f"Error processing query: {str(e)}"
+
+@st.cache_data(show_spinner=False, max_entries=128)
+def answer_query(query_lower, version):
+    """Rendered answer for a normalised question, reused until the data changes"""
     response = ""
     
-    try:
-        if any(word in query_lower for word in ['risk', 'mitigation', 'assessment']):
-            pending = len([r for r in maint_data if r.get('status') == 'Pending'])
-            in_progress = len([r for r in maint_data if r.get('status') == 'In Progress'])
-            critical = len([r for r in safety_data if r.get('severity') in ['High', 'Critical']])
-            
-            response = "🔍 **OPERATIONAL RISK ASSESSMENT**\n\n"
-            if pending > 2:
-                response += f"🚨 **High Risk**: {pending} pending maintenance tasks\n"
-            if critical > 0:
-                response += f"🚨 **Critical Alert**: {critical} critical/high severity incidents\n"
-            if in_progress > 0:
-                response += f"⏳ **In Progress**: {in_progress} maintenance tasks currently being worked on\n"
-            if pending <= 2 and critical == 0:
-                response += "✅ **Green Status**: Operations within acceptable parameters"
-        
-        elif any(word in query_lower for word in ['trend', 'pattern', 'analyze']):
-            response = "📊 **TREND ANALYSIS & PATTERNS**\n\n"
-            
-            if maint_data:
-                types = {}
-                for r in maint_data:
-                    t = r.get('maintenance_type', 'Unknown')
-                    types[t] = types.get(t, 0) + 1
-                sorted_types = sorted(types.items(), key=lambda x: x[1], reverse=True)
-                response += "**Maintenance Types (most frequent):**\n"
-                for mtype, count in sorted_types[:5]:
-                    response += f"- {mtype}: {count} occurrences\n"
-            
-            if safety_data:
-                severity = {}
-                for r in safety_data:
-                    s = r.get('severity', 'Unknown')
-                    severity[s] = severity.get(s, 0) + 1
-                response += "\n**Safety Incident Severity:**\n"
-                for sev, count in severity.items():
-                    response += f"- {sev}: {count} incidents\n"
-        
-        elif 'maintenance' in query_lower:
-            if len(maint_data) > 0:
-                total_hours = sum(float(r.get('hours_spent', 0)) for r in maint_data)
-                pending = len([r for r in maint_data if r.get('status') == 'Pending'])
-                completed = len([r for r in maint_data if r.get('status') == 'Completed'])
-                response = f"📊 **MAINTENANCE OVERVIEW**\n- Total records: {len(maint_data)}\n- Total hours: {total_hours:.1f}\n- Pending: {pending}\n- Completed: {completed}"
-            else:
-                response = "No maintenance records found"
+    if any(word in query_lower for word in ['risk', 'mitigation', 'assessment']):
+        statuses = maintenance_metrics(version)['statuses']
+        pending = statuses['Pending']
+        in_progress = statuses['In Progress']
+        critical = safety_metrics(version)['critical']
         
-        elif 'safety' in query_lower or 'incident' in query_lower:
-            if len(safety_data) > 0:
-                critical = len([r for r in safety_data if r.get('severity') in ['High', 'Critical']])
-                medium = len([r for r in safety_data if r.get('severity') == 'Medium'])
-                low = len([r for r in safety_data if r.get('severity') == 'Low'])
-                response = f"📊 **SAFETY INCIDENTS**\n- Total: {len(safety_data)}\n- Critical/High: {critical}\n- Medium: {medium}\n- Low: {low}"
-            else:
-                response = "No safety records found"
-        
-        elif 'flight' in query_lower or 'passenger' in query_lower:
-            if len(flights_data) > 0:
-                total_pass = sum(int(r.get('passengers_count', 0)) for r in flights_data)
-                avg_pass = total_pass / len(flights_data) if len(flights_data) > 0 else 0
-                response = f"✈️ **FLIGHT OPERATIONS**\n- Total flights: {len(flights_data)}\n- Total passengers: {total_pass}\n- Average per flight: {avg_pass:.0f}"
-            else:
-                response = "No flight records found"
-        
-        elif 'dashboard' in query_lower or 'summary' in query_lower:
-            total_maint = len(maint_data)
-            total_hours = sum(float(r.get('hours_spent', 0)) for r in maint_data) if maint_data else 0
-            total_safety = len(safety_data)
-            critical = len([r for r in safety_data if r.get('severity') in ['High', 'Critical']]) if safety_data else 0
-            total_flights = len(flights_data)
-            total_pass = sum(int(r.get('passengers_count', 0)) for r in flights_data) if flights_data else 0
-            response = f"""📊 **EXECUTIVE SUMMARY**
-- Maintenance: {total_maint} records, {total_hours:.1f} hours
-- Safety: {total_safety} incidents, {critical} critical
-- Flights: {total_flights} flights, {total_pass} passengers"""
+        response = "🔍 **OPERATIONAL RISK ASSESSMENT**\n\n"
+        if pending > 2:
+            response += f"🚨 **High Risk**: {pending} pending maintenance tasks\n"
+        if critical > 0:
+            response += f"🚨 **Critical Alert**: {critical} critical/high severity incidents\n"
+        if in_progress > 0:
+            response += f"⏳ **In Progress**: {in_progress} maintenance tasks currently being worked on\n"
+        if pending <= 2 and critical == 0:
+            response += "✅ **Green Status**: Operations within acceptable parameters"
+    
+    elif any(word in query_lower for word in ['trend', 'pattern', 'analyze']):
+        response = "📊 **TREND ANALYSIS & PATTERNS**\n\n"
         
-        elif 'hours' in query_lower:
-            if maint_data:
-                total_hours = sum(float(r.get('hours_spent', 0)) for r in maint_data)
-                avg_hours = total_hours / len(maint_data)
-                response = f"⏱️ **MAINTENANCE HOURS**\n- Total: {total_hours:.1f} hours\n- Average per task: {avg_hours:.1f} hours\n- Tasks: {len(maint_data)}"
-            else:
-                response = "No maintenance data"
+        if maint_data:
+            # The type Counter is tallied once per data version; most_common keeps only the top five
+            top_types = maintenance_metrics(version)['types'].most_common(5)
+            response += "**Maintenance Types (most frequent):**\n"
+            for mtype, count in top_types:
+                response += f"- {mtype}: {count} occurrences\n"
         
-        if not response:
-            response = "🤖 Ask about: risks, trends, maintenance, safety, flights, hours, dashboard, or patterns"
+        if safety_data:
+            severity = safety_metrics(version)['severity']
+            response += "\n**Safety Incident Severity:**\n"
+            for sev, count in severity.items():
+                response += f"- {sev}: {count} incidents\n"
     
-    except Exception as e:
-        response = f"Error processing query: {str(e)}"
+    elif 'maintenance' in query_lower:
+        if len(maint_data) > 0:
+            # Hours and status counts come from the same single pass as the AI prompt
+            maint = maintenance_metrics(version)
+            response = f"📊 **MAINTENANCE OVERVIEW**\n- Total records: {maint['count']}\n- Total hours: {maint['total_hours']:.1f}\n- Pending: {maint['pending']}\n- Completed: {maint['statuses']['Completed']}"
+        else:
+            response = "No maintenance records found"
+    
+    elif 'safety' in query_lower or 'incident' in query_lower:
+        if len(safety_data) > 0:
+            # Every figure comes from the one severity tally
+            safety = safety_metrics(version)
+            severity = safety['severity']
+            response = f"📊 **SAFETY INCIDENTS**\n- Total: {safety['count']}\n- Critical/High: {safety['critical']}\n- Medium: {severity['Medium']}\n- Low: {severity['Low']}"
+        else:
+            response = "No safety records found"
+    
+    elif 'flight' in query_lower or 'passenger' in query_lower:
+        if len(flights_data) > 0:
+            flights = flight_metrics(version)
+            response = f"✈️ **FLIGHT OPERATIONS**\n- Total flights: {flights['count']}\n- Total passengers: {flights['total_passengers']}\n- Average per flight: {flights['avg_passengers']:.0f}"
+        else:
+            response = "No flight records found"
+    
+    elif 'dashboard' in query_lower or 'summary' in query_lower:
+        # Aggregates are shared per data version with the AI prompt
+        maint = maintenance_metrics(version)
+        safety = safety_metrics(version)
+        flights = flight_metrics(version)
+        response = f"""📊 **EXECUTIVE SUMMARY**
+- Maintenance: {maint['count']} records, {maint['total_hours']:.1f} hours
+- Safety: {safety['count']} incidents, {safety['critical']} critical
+- Flights: {flights['count']} flights, {flights['total_passengers']} passengers"""
+    
+    elif 'hours' in query_lower:
+        if maint_data:
+            maint = maintenance_metrics(version)
+            response = f"⏱️ **MAINTENANCE HOURS**\n- Total: {maint['total_hours']:.1f} hours\n- Average per task: {maint['avg_hours']:.1f} hours\n- Tasks: {maint['count']}"
+        else:
+            response = "No maintenance data"
+    
+    if not response:
+        response = "🤖 Ask about: risks, trends, maintenance, safety, flights, hours, dashboard, or patterns"
     
     return response
 
@@ -770,7 +1033,7 @@ else:
             st.rerun()
     
     st.title("✈️ AirSial Enterprise")
-    page = st.sidebar.radio("Navigate", ["🤖 AI Chat", "📊 Dashboard", "📝 Submit", "📋 Manage", "📤 Upload", "📥 Export"])
+    page = st.sidebar.radio("Navigate", UPLOAD_PAGES if st.session_state.user_role in UPLOAD_ROLES else PAGES)
     
     if page == "🤖 AI Chat":
         st.header("🤖 AI Agent - Operational Intelligence")
@@ -785,31 +1048,24 @@ else:
                 else:
                     st.markdown(f'<div class="ai-response">**🤖 AI Agent:**\n{msg["content"]}</div>', unsafe_allow_html=True)
         
-        # Input section
-        st.divider()
-        
-        col1, col2 = st.columns([5, 1])
-        with col1:
-            user_input = st.text_input("Ask a question...", placeholder="e.g., What are the maintenance trends? Why is aircraft ABC having issues? Compare engineer efficiency...", key="chat_input")
-        with col2:
-            send_btn = st.button("Send", use_container_width=True)
+        # Input section; st.chat_input submits once and clears itself, so no Send button or rerun is needed
+        user_input = st.chat_input("e.g., What are the maintenance trends? Why is aircraft ABC having issues? Compare engineer efficiency...", key="chat_input")
         
         # Process input
-        if send_btn and user_input:
-            # Add user message
-            st.session_state.chat_history.append({'role': 'user', 'content': user_input})
+        if user_input:
+            queue_question(user_input)
             
-            # Generate AI response
+            # Generate AI response and show the new exchange in this same run
             ai_response = process_ai_query(user_input)
             st.session_state.chat_history.append({'role': 'assistant', 'content': ai_response})
-            
-            # Rerun to show new messages
-            st.rerun()
+            with chat_container:
+                st.markdown(f"**👤 You:** {user_input}")
+                st.markdown(f'<div class="ai-response">**🤖 AI Agent:**\n{ai_response}</div>', unsafe_allow_html=True)
         
         # Clear history button
         if st.session_state.chat_history:
             if st.button("Clear Chat"):
-                st.session_state.chat_history = []
+                st.session_state.chat_history.clear()
                 st.rerun()
     
     elif page == "📊 Dashboard":
@@ -820,23 +1076,13 @@ else:
         col2.metric("Safety", len(safety_data))
         col3.metric("Flights", len(flights_data))
         
-        st.subheader(f"Maintenance Records ({len(maint_data)})")
-        if maint_data:
-            st.table(maint_data)
-        else:
-            st.info("No records")
-        
-        st.subheader(f"Safety Records ({len(safety_data)})")
-        if safety_data:
-            st.table(safety_data)
-        else:
-            st.info("No records")
-        
-        st.subheader(f"Flight Records ({len(flights_data)})")
-        if flights_data:
-            st.table(flights_data)
-        else:
-            st.info("No records")
+        sections = [("Maintenance", maint_data), ("Safety", safety_data), ("Flight", flights_data)]
+        for label, records in sections:
+            st.subheader(f"{label} Records ({len(records)})")
+            if records:
+                st.dataframe(records, use_container_width=True, hide_index=True)
+            else:
+                st.info("No records")
     
     elif page == "📝 Submit":
         st.header("📝 Submit Report")
@@ -854,7 +1100,7 @@ else:
                 
                 if st.form_submit_button("Submit"):
                     new_record = {
-                        "id": str(len(maint_data) + 1),
+                        "id": str(next_id(maint_data, MAINTENANCE_FILE)),
                         "aircraft_registration": aircraft,
                         "maintenance_date": str(maint_date),
                         "maintenance_type": maint_type,
@@ -865,7 +1111,7 @@ else:
                         "created_at": datetime.now().isoformat()
                     }
                     maint_data.append(new_record)
-                    write_csv(MAINTENANCE_FILE, maint_data, MAINTENANCE_COLS)
+                    append_csv(MAINTENANCE_FILE, [new_record], MAINTENANCE_COLS)
                     st.success("✅ Added!")
                     st.rerun()
         
@@ -881,7 +1127,7 @@ else:
                 
                 if st.form_submit_button("Submit"):
                     new_record = {
-                        "id": str(len(safety_data) + 1),
+                        "id": str(next_id(safety_data, SAFETY_FILE)),
                         "incident_date": str(incident_date),
                         "flight_number": flight,
                         "incident_type": incident_type,
@@ -892,7 +1138,7 @@ else:
                         "created_at": datetime.now().isoformat()
                     }
                     safety_data.append(new_record)
-                    write_csv(SAFETY_FILE, safety_data, SAFETY_COLS)
+                    append_csv(SAFETY_FILE, [new_record], SAFETY_COLS)
                     st.success("✅ Added!")
                     st.rerun()
         
@@ -909,7 +1155,7 @@ else:
                 
                 if st.form_submit_button("Submit"):
                     new_record = {
-                        "id": str(len(flights_data) + 1),
+                        "id": str(next_id(flights_data, FLIGHTS_FILE)),
                         "flight_number": flight,
                         "date": str(flight_date),
                         "departure_airport": dept,
@@ -921,123 +1167,54 @@ else:
                         "created_at": datetime.now().isoformat()
                     }
                     flights_data.append(new_record)
-                    write_csv(FLIGHTS_FILE, flights_data, FLIGHTS_COLS)
+                    append_csv(FLIGHTS_FILE, [new_record], FLIGHTS_COLS)
                     st.success("✅ Added!")
                     st.rerun()
     
     elif page == "📋 Manage":
         st.header("📋 Manage Data")
         data_type = st.selectbox("Select", ["Maintenance", "Safety", "Flights"])
+        data, cols, filename, key = {
+            "Maintenance": (maint_data, MAINTENANCE_COLS, MAINTENANCE_FILE, "maint"),
+            "Safety": (safety_data, SAFETY_COLS, SAFETY_FILE, "safety"),
+            "Flights": (flights_data, FLIGHTS_COLS, FLIGHTS_FILE, "flights"),
+        }[data_type]
         
-        if data_type == "Maintenance":
-            search = st.text_input("Search...")
-            filtered = [r for r in maint_data if not search or search.lower() in str(r).lower()]
-            
-            st.table(filtered)
-            
-            if st.session_state.user_role == "Admin":
-                st.divider()
-                st.subheader("🗑️ Bulk Delete by Range")
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    start_id = st.text_input("Start ID (e.g., 1)", key="start_maint")
-                with col2:
-                    end_id = st.text_input("End ID (e.g., 100)", key="end_maint")
-                
-                if st.button("🗑️ Delete Records in Range", key="del_range_maint"):
-                    if start_id and end_id:
-                        try:
-                            start = int(start_id)
-                            end = int(end_id)
-                            original_len = len(maint_data)
-                            maint_data[:] = [r for r in maint_data if not (start <= int(r.get("id", 0)) <= end)]
-                            deleted = original_len - len(maint_data)
-                            if deleted > 0:
-                                write_csv(MAINTENANCE_FILE, maint_data, MAINTENANCE_COLS)
-                                st.success(f"✅ Deleted {deleted} records (ID {start}-{end})!")
-                                st.rerun()
-                            else:
-                                st.warning("No records found in that range!")
-                        except:
-                            st.error("Invalid IDs! Use numbers only.")
-                    else:
-                        st.error("Enter both Start and End IDs")
+        search = st.text_input("Search...")
+        filtered = filter_records(data, filename, cols, search)
         
-        elif data_type == "Safety":
-            search = st.text_input("Search...")
-            filtered = [r for r in safety_data if not search or search.lower() in str(r).lower()]
-            
-            st.table(filtered)
-            
-            if st.session_state.user_role == "Admin":
-                st.divider()
-                st.subheader("🗑️ Bulk Delete by Range")
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    start_id = st.text_input("Start ID (e.g., 1)", key="start_safety")
-                with col2:
-                    end_id = st.text_input("End ID (e.g., 100)", key="end_safety")
-                
-                if st.button("🗑️ Delete Records in Range", key="del_range_safety"):
-                    if start_id and end_id:
-                        try:
-                            start = int(start_id)
-                            end = int(end_id)
-                            original_len = len(safety_data)
-                            safety_data[:] = [r for r in safety_data if not (start <= int(r.get("id", 0)) <= end)]
-                            deleted = original_len - len(safety_data)
-                            if deleted > 0:
-                                write_csv(SAFETY_FILE, safety_data, SAFETY_COLS)
-                                st.success(f"✅ Deleted {deleted} records (ID {start}-{end})!")
-                                st.rerun()
-                            else:
-                                st.warning("No records found in that range!")
-                        except:
-                            st.error("Invalid IDs! Use numbers only.")
-                    else:
-                        st.error("Enter both Start and End IDs")
+        st.dataframe(filtered, use_container_width=True, hide_index=True)
         
-        else:
-            search = st.text_input("Search...")
-            filtered = [r for r in flights_data if not search or search.lower() in str(r).lower()]
+        if st.session_state.user_role == "Admin":
+            st.divider()
+            st.subheader("🗑️ Bulk Delete by Range")
+            col1, col2 = st.columns(2)
             
-            st.table(filtered)
+            with col1:
+                start_id = st.text_input("Start ID (e.g., 1)", key=f"start_{key}")
+            with col2:
+                end_id = st.text_input("End ID (e.g., 100)", key=f"end_{key}")
             
-            if st.session_state.user_role == "Admin":
-                st.divider()
-                st.subheader("🗑️ Bulk Delete by Range")
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    start_id = st.text_input("Start ID (e.g., 1)", key="start_flights")
-                with col2:
-                    end_id = st.text_input("End ID (e.g., 100)", key="end_flights")
-                
-                if st.button("🗑️ Delete Records in Range", key="del_range_flights"):
-                    if start_id and end_id:
-                        try:
-                            start = int(start_id)
-                            end = int(end_id)
-                            original_len = len(flights_data)
-                            flights_data[:] = [r for r in flights_data if not (start <= int(r.get("id", 0)) <= end)]
-                            deleted = original_len - len(flights_data)
-                            if deleted > 0:
-                                write_csv(FLIGHTS_FILE, flights_data, FLIGHTS_COLS)
-                                st.success(f"✅ Deleted {deleted} records (ID {start}-{end})!")
-                                st.rerun()
-                            else:
-                                st.warning("No records found in that range!")
-                        except:
-                            st.error("Invalid IDs! Use numbers only.")
-                    else:
-                        st.error("Enter both Start and End IDs")
+            if st.button("🗑️ Delete Records in Range", key=f"del_range_{key}"):
+                if start_id and end_id:
+                    try:
+                        start = int(start_id)
+                        end = int(end_id)
+                        deleted = delete_id_range(data, filename, cols, start, end)
+                        if deleted > 0:
+                            st.success(f"✅ Deleted {deleted} records (ID {start}-{end})!")
+                            st.rerun()
+                        else:
+                            st.warning("No records found in that range!")
+                    except:
+                        st.error("Invalid IDs! Use numbers only.")
+                else:
+                    st.error("Enter both Start and End IDs")
     
     elif page == "📤 Upload":
         st.header("📤 Bulk Upload")
         
-        if st.session_state.user_role not in ["Admin", "Manager"]:
+        if st.session_state.user_role not in UPLOAD_ROLES:
             st.error("Only Admins/Managers")
         else:
             data_type = st.selectbox("Type", ["Maintenance", "Safety", "Flights"])
@@ -1045,12 +1222,10 @@ else:
             
             if file:
                 try:
-                    content = file.read().decode('utf-8')
-                    reader = csv.DictReader(io.StringIO(content))
-                    rows = list(reader)
+                    preview, row_count = preview_upload(file)
                     
-                    st.write(f"Preview: {len(rows)} rows")
-                    st.table(rows[:10])
+                    st.write(f"Preview: {row_count} rows")
+                    st.dataframe(preview, use_container_width=True, hide_index=True)
                     
                     if st.button("✅ Upload All"):
                         # Get the correct columns based on data type
@@ -1067,27 +1242,13 @@ else:
                             data_list = flights_data
                             filename = FLIGHTS_FILE
                         
-                        # Clean rows - only keep valid columns and auto-generate IDs
-                        cleaned_rows = []
-                        next_id = max([int(r.get("id", 0)) for r in data_list] + [0]) + 1
-                        
-                        for row in rows:
-                            cleaned_row = {}
-                            for col in cols:
-                                if col == "id":
-                                    cleaned_row[col] = str(next_id)
-                                    next_id += 1
-                                else:
-                                    cleaned_row[col] = row.get(col, "")
-                            cleaned_rows.append(cleaned_row)
+                        # Clean rows - only keep valid columns and auto-generate IDs, appending to the CSV as we go
+                        progress = st.progress(0.0)
+                        uploaded = 0
+                        for uploaded in import_upload(file, data_list, cols, filename):
+                            progress.progress(min(uploaded / max(row_count, 1), 1.0))
                         
-                        # Append to data
-                        data_list.extend(cleaned_rows)
-                        
-                        # Write to CSV
-                        write_csv(filename, data_list, cols)
-                        
-                        st.success(f"✅ {len(rows)} records uploaded!")
+                        st.success(f"✅ {uploaded} records uploaded!")
                         st.rerun()
                 except Exception as e:
                     st.error(f"Error: {str(e)}")
@@ -1095,23 +1256,11 @@ else:
     elif page == "📥 Export":
         st.header("📥 Export Data")
         
-        if st.button("Export Maintenance"):
-            output = io.StringIO()
-            writer = csv.DictWriter(output, fieldnames=MAINTENANCE_COLS)
-            writer.writeheader()
-            writer.writerows(maint_data)
-            st.download_button("📥 maintenance.csv", output.getvalue(), "maintenance.csv")
-        
-        if st.button("Export Safety"):
-            output = io.StringIO()
-            writer = csv.DictWriter(output, fieldnames=SAFETY_COLS)
-            writer.writeheader()
-            writer.writerows(safety_data)
-            st.download_button("📥 safety.csv", output.getvalue(), "safety.csv")
-        
-        if st.button("Export Flights"):
-            output = io.StringIO()
-            writer = csv.DictWriter(output, fieldnames=FLIGHTS_COLS)
-            writer.writeheader()
-            writer.writerows(flights_data)
-            st.download_button("📥 flights.csv", output.getvalue(), "flights.csv")
+        exports = [
+            ("Maintenance", MAINTENANCE_FILE, MAINTENANCE_COLS, "maintenance.csv"),
+            ("Safety", SAFETY_FILE, SAFETY_COLS, "safety.csv"),
+            ("Flights", FLIGHTS_FILE, FLIGHTS_COLS, "flights.csv"),
+        ]
+        for label, data_file, cols, filename in exports:
+            if st.button(f"Export {label}"):
+                st.download_button(f"📥 {filename}", export_csv(data_file, cols), filename, mime="text/csv")